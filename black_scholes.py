@@ -1,10 +1,18 @@
-from scipy import stats
+from scipy.special import ndtr
 import numpy as np
-import datetime as dt
 
 
-_norm_cdf = stats.norm(0, 1).cdf
-_norm_pdf = stats.norm(0, 1).pdf
+# Times to expiry in years (about 3 ms) below which options are valued at expiry, as d1 and d2 are no longer finite
+MIN_TIME_TO_EXPIRY = 1e-10
+
+_INV_SQRT_2PI = 1.0 / np.sqrt(2.0 * np.pi)
+
+# ndtr is the C implementation behind norm.cdf, calling it directly skips the scipy.stats dispatch overhead
+_norm_cdf = ndtr
+
+
+def _norm_pdf(x):
+    return np.exp(-0.5 * x * x) * _INV_SQRT_2PI
 
 
 def _d1(S, K, T, r, sigma):
@@ -44,9 +52,13 @@ def call_value(S, K, T, r, sigma):
         The fair present value of the option.
     """
 
-    return S * _norm_cdf(_d1(S, K, T, r, sigma)) - K * np.exp(-r * T) * _norm_cdf(
-        _d2(S, K, T, r, sigma)
-    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = S * _norm_cdf(_d1(S, K, T, r, sigma)) - K * np.exp(-r * T) * _norm_cdf(
+            _d2(S, K, T, r, sigma)
+        )
+
+    # At expiry the option is worth its intrinsic value
+    return np.where(T > MIN_TIME_TO_EXPIRY, value, np.maximum(S - K, 0.0))[()]
 
 
 def put_value(S, K, T, r, sigma):
@@ -78,9 +90,13 @@ def put_value(S, K, T, r, sigma):
         The fair present value of the option.
     """
 
-    return np.exp(-r * T) * K * _norm_cdf(-_d2(S, K, T, r, sigma)) - S * _norm_cdf(
-        -_d1(S, K, T, r, sigma)
-    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.exp(-r * T) * K * _norm_cdf(-_d2(S, K, T, r, sigma)) - S * _norm_cdf(
+            -_d1(S, K, T, r, sigma)
+        )
+
+    # At expiry the option is worth its intrinsic value
+    return np.where(T > MIN_TIME_TO_EXPIRY, value, np.maximum(K - S, 0.0))[()]
 
 
 def call_delta(S, K, T, r, sigma):
@@ -113,7 +129,11 @@ def call_delta(S, K, T, r, sigma):
         The fair present value of the option.
     """
 
-    return _norm_cdf(_d1(S, K, T, r, sigma))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = _norm_cdf(_d1(S, K, T, r, sigma))
+
+    # At expiry the delta is a step function of the underlying
+    return np.where(T > MIN_TIME_TO_EXPIRY, delta, np.where(S > K, 1.0, 0.0))[()]
 
 
 def put_delta(S, K, T, r, sigma):
@@ -179,7 +199,11 @@ def call_vega(S, K, T, r, sigma):
         The fair present value of the option.
     """
 
-    return S * _norm_pdf(_d1(S, K, T, r, sigma)) * np.sqrt(T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vega = S * _norm_pdf(_d1(S, K, T, r, sigma)) * np.sqrt(T)
+
+    # At expiry the value no longer depends on the volatility
+    return np.where(T > MIN_TIME_TO_EXPIRY, vega, 0.0)[()]
 
 
 def put_vega(S, K, T, r, sigma):
@@ -244,6 +268,9 @@ def gamma(S, K, T, r, sigma):
     call_delta : float
         The fair present value of the option.
     """
-    d1=(np.log(S/K) + (r + 0.5 * sigma**2)*T) / (sigma * np.sqrt(T))
-    
-    return _norm_pdf(d1) / (S * sigma * np.sqrt(T))
\ No newline at end of file
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = _d1(S, K, T, r, sigma)
+        option_gamma = _norm_pdf(d1) / (S * sigma * np.sqrt(T))
+
+    # At expiry the delta is a step function of the underlying, taken as flat on either side of the strike
+    return np.where(T > MIN_TIME_TO_EXPIRY, option_gamma, 0.0)[()]
@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+from numba import njit, types
+
+from black_scholes import MIN_TIME_TO_EXPIRY
+
+
+_INV_SQRT_2 = 1.0 / math.sqrt(2.0)
+_INV_SQRT_2PI = 1.0 / math.sqrt(2.0 * math.pi)
+
+# Square root of MIN_TIME_TO_EXPIRY, below which options are valued at expiry
+_MIN_SQRT_T = math.sqrt(MIN_TIME_TO_EXPIRY)
+
+
+@njit(types.float64(types.float64), cache=True, fastmath=True)
+def _norm_cdf(x):
+    return 0.5 * (1.0 + math.erf(x * _INV_SQRT_2))
+
+
+@njit(types.float64(types.float64), cache=True, fastmath=True)
+def _norm_pdf(x):
+    return _INV_SQRT_2PI * math.exp(-0.5 * x * x)
+
+
+@njit(cache=True)
+def bs_expiry_terms(T, r, sigma):
+    """
+    The terms of the Black-scholes formulas that only depend on the time to expiry <T>, for a fixed
+    interest rate <r> and stock volatility <sigma>. Options sharing an expiry share these terms, so
+    they are computed once per expiry rather than once per option. <T> can be a float or an array.
+
+    Returns
+    -------
+    sqrt_T, sigma_sqrt_T, drift, disc : tuple
+        sqrt(T), sigma * sqrt(T), (r + sigma^2 / 2) * T and the discount factor exp(-r * T).
+    """
+
+    sqrt_T = np.sqrt(T)
+    return sqrt_T, sigma * sqrt_T, (r + 0.5 * sigma * sigma) * T, np.exp(-r * T)
+
+
+@njit(
+    types.UniTuple(types.float64, 3)(
+        types.float64, types.float64, types.float64, types.float64, types.float64, types.float64,
+        types.boolean
+    ),
+    cache=True,
+    fastmath=True,
+)
+def _bs_price_delta_vega(S, K, sqrt_T, sigma_sqrt_T, drift, disc, is_call):
+    d1 = (math.log(S / K) + drift) / sigma_sqrt_T
+    d2 = d1 - sigma_sqrt_T
+    discounted_strike = K * disc
+
+    vega = S * _norm_pdf(d1) * sqrt_T
+    if is_call:
+        delta = _norm_cdf(d1)
+        price = S * delta - discounted_strike * _norm_cdf(d2)
+    else:
+        delta = _norm_cdf(d1) - 1.0
+        price = discounted_strike * _norm_cdf(-d2) - S * _norm_cdf(-d1)
+
+    return price, delta, vega
+
+
+@njit(
+    types.UniTuple(types.float64, 3)(
+        types.float64, types.float64, types.float64, types.float64, types.float64, types.boolean
+    ),
+    cache=True,
+    fastmath=True,
+)
+def bs_price_delta_vega(S, K, T, r, sigma, is_call):
+    """
+    The fair value, delta and vega of a call or put option under the Black-scholes model, for an
+    option with strike <K>, expiring in <T> years, under a fixed interest rate <r>, a stock
+    volatility <sigma>, and when the current price of the underlying stock is <S>. d1, d2 and the
+    discount factor are computed once and shared between the three outputs.
+
+    Parameters
+    ----------
+    S : float
+        The value of the underlying stock.
+
+    K : float
+        The strike price of the option.
+
+    T : float
+        Time to expiry in years.
+
+    r : float
+        The fixed interest rate valid between now and expiry.
+
+    sigma : float
+        The volatility of the underlying stock process.
+
+    is_call : bool
+        True for a call option, False for a put option.
+
+    Returns
+    -------
+    price, delta, vega : tuple of float
+        The fair present value, delta and vega of the option.
+    """
+
+    sqrt_T = math.sqrt(T)
+    return _bs_price_delta_vega(S, K, sqrt_T, sigma * sqrt_T, (r + 0.5 * sigma * sigma) * T, math.exp(-r * T), is_call)
+
+
+@njit(cache=True)
+def bs_chain_price_delta_vega(S, K, sqrt_T, sigma_sqrt_T, drift, disc, is_call):
+    """
+    Applies bs_price_delta_vega to every option of a chain, described by arrays of strikes <K> and
+    a boolean mask <is_call>, at the underlying price <S>. The time to expiry enters through the
+    per-option arrays returned by bs_expiry_terms, so d1 reduces to one log, one add and one divide.
+    Options at (or past) expiry are valued at their intrinsic value, with a step delta and no vega.
+
+    Returns
+    -------
+    prices, deltas, vegas : tuple of np.ndarray
+        The fair present values, deltas and vegas of the options.
+    """
+
+    n = K.shape[0]
+    prices = np.empty(n)
+    deltas = np.empty(n)
+    vegas = np.empty(n)
+    for i in range(n):
+        # Written as a negation so that a NaN square root, from a negative time to expiry, also takes this branch
+        if not sqrt_T[i] > _MIN_SQRT_T:
+            if is_call[i]:
+                prices[i] = max(S - K[i], 0.0)
+                deltas[i] = 1.0 if S > K[i] else 0.0
+            else:
+                prices[i] = max(K[i] - S, 0.0)
+                deltas[i] = -1.0 if S < K[i] else 0.0
+            vegas[i] = 0.0
+            continue
+        prices[i], deltas[i], vegas[i] = _bs_price_delta_vega(
+            S, K[i], sqrt_T[i], sigma_sqrt_T[i], drift[i], disc[i], is_call[i]
+        )
+
+    return prices, deltas, vegas
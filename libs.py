@@ -1,4 +1,10 @@
 import datetime as dt
+import threading
+import time
+from collections import deque
+
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
 
 
 def calculate_current_time_to_date(expiry_date) -> float:
@@ -35,4 +41,58 @@ def calculate_time_to_date(expiry_date, current_time) -> float:
         current_time: A dt.datetime object representing the current datetime to assume.
     """
 
-    return (expiry_date - current_time) / dt.timedelta(days=1) / 365
\ No newline at end of file
+    return (expiry_date - current_time) / dt.timedelta(days=1) / 365
+
+
+def calculate_tte_epoch(expiry_epoch, now_epoch):
+    """
+    Returns the total time remaining until some future point in time, both given as seconds since the epoch. The
+    remaining time is provided in fractions of years. Works element-wise on np.ndarrays of expiries as well.
+
+    Example usage:
+        import datetime as dt
+        import time
+
+        expiry_epoch = dt.datetime(2022, 12, 31, 12, 0, 0).timestamp()
+        tte = calculate_tte_epoch(expiry_epoch, time.time())
+
+    Arguments:
+        expiry_epoch: Seconds since the epoch of the datetime of expiry, e.g. from dt.datetime.timestamp().
+        now_epoch: Seconds since the epoch of the current time to assume, e.g. from time.time().
+    """
+
+    return (expiry_epoch - now_epoch) / SECONDS_PER_YEAR
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter allowing at most <max_calls> calls to acquire() within any sliding window of <period> seconds.
+    Callers beyond that block until the oldest call in the window has expired.
+
+    Example usage:
+        limiter = RateLimiter(max_calls=5, period=1.0)
+        limiter.acquire()
+        exchange.insert_order(...)
+
+    Arguments:
+        max_calls: The number of calls allowed per window.
+        period: The length of the window in seconds.
+    """
+
+    def __init__(self, max_calls, period):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                wait = self.period - (now - self._calls[0])
+            time.sleep(wait)
@@ -1,41 +1,80 @@
 import datetime as dt
 import time
 import logging
-import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from optibook.synchronous_client import Exchange
 from optibook.common_types import InstrumentType, OptionKind
 
 from math import floor, ceil
-from black_scholes import call_value, put_value, call_delta, put_delta, call_vega, put_vega, gamma
-from libs import calculate_current_time_to_date
+from black_scholes import call_vega, MIN_TIME_TO_EXPIRY
+from bs_kernel import bs_chain_price_delta_vega, bs_expiry_terms
+from libs import calculate_tte_epoch, RateLimiter
 
 exchange = Exchange()
 exchange.connect()
 
 logging.getLogger('client').setLevel('ERROR')
 
+# Per-option details are only logged when DEBUG is set, the trade loop otherwise logs a summary per iteration
+DEBUG = False
+logging.basicConfig(format='%(message)s')
+log = logging.getLogger('options_quoter')
+log.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+
+# Quotes last inserted per option, as (bid_price, ask_price, bid_volume, ask_volume, position), see update_quotes
+last_quotes = {}
+
+# Outstanding orders are pulled and reinserted at least this often, even if the quotes did not change
+REQUOTE_EVERY_N_ITERATIONS = 10
+
+# The trade loop only reprices, requotes and hedges once the stock midpoint moved by at least half a tick, polling the
+# stock book every POLL_INTERVAL_SECONDS meanwhile. Without such a move it still runs every MAX_SECONDS_BETWEEN_UPDATES,
+# the former fixed sleep, so fills are hedged and requoted as promptly as before in static markets.
+POLL_INTERVAL_SECONDS = 0.1
+MAX_SECONDS_BETWEEN_UPDATES = 4
+
+# Options are requoted concurrently, as each requote mostly waits on exchange round trips. Across all threads a
+# requote, or a hedge order (see trade_at_best_price), is started at most once every 1/5th of a second, spread evenly
+# rather than in bursts, to avoid breaching the exchange frequency limit however often the trade loop runs. As starts
+# are paced, the pool does not requote any faster than one option per 1/5th of a second: it only saves the round trips
+# the former loop spent on top of its fixed sleep per option.
+quote_executor = ThreadPoolExecutor(max_workers=8)
+quote_rate_limiter = RateLimiter(max_calls=1, period=0.2)
+
+# The synchronous client is not documented to be thread-safe, so the worker threads take turns calling the exchange
+exchange_lock = threading.Lock()
+
 
 def round_down_to_tick(price, tick_size):
     """
     Rounds a price down to the nearest tick, e.g. if the tick size is 0.10, a price of 0.97 will get rounded to 0.90.
+    The price is scaled to whole ticks and back, so the result is the closest float to the tick (0.9, not 0.9000000000000001).
     """
-    return floor(price / tick_size) * tick_size
+    ticks_per_unit = round(1.0 / tick_size)
+    return floor(price * ticks_per_unit) / ticks_per_unit
 
 
 def round_up_to_tick(price, tick_size):
     """
     Rounds a price up to the nearest tick, e.g. if the tick size is 0.10, a price of 1.34 will get rounded to 1.40.
+    The price is scaled to whole ticks and back, so the result is the closest float to the tick.
     """
-    return ceil(price / tick_size) * tick_size
+    ticks_per_unit = round(1.0 / tick_size)
+    return ceil(price * ticks_per_unit) / ticks_per_unit
 
 
-def get_midpoint_value(instrument_id):
+def get_midpoint_value(instrument_id, order_book=None):
     """
     This function calculates the current midpoint of the order book supplied by the exchange for the instrument
     specified by <instrument_id>, returning None if either side or both sides do not have any orders available.
+    An already fetched <order_book> can be passed in to avoid requesting it from the exchange again.
     """
-    order_book = exchange.get_last_price_book(instrument_id=instrument_id)
+    if order_book is None:
+        order_book = exchange.get_last_price_book(instrument_id=instrument_id)
 
     # If the instrument doesn't have prices at all or on either side, we cannot calculate a midpoint and return None
     if not (order_book and order_book.bids and order_book.asks):
@@ -45,57 +84,13 @@ def get_midpoint_value(instrument_id):
         return midpoint
 
 
-def calculate_theoretical_option_value(expiry, strike, option_kind, stock_value, interest_rate, volatility):
-    """
-    This function calculates the current fair call or put value based on Black & Scholes assumptions.
-
-    expiry: dt.date          -  Expiry date of the option
-    strike: float            -  Strike price of the option
-    option_kind: OptionKind  -  Type of the option
-    stock_value:             -  Assumed stock value when calculating the Black-Scholes value
-    interest_rate:           -  Assumed interest rate when calculating the Black-Scholes value
-    volatility:              -  Assumed volatility of when calculating the Black-Scholes value
-    """
-    time_to_expiry = calculate_current_time_to_date(expiry)
-
-    if option_kind == OptionKind.CALL:
-        option_value = call_value(S=stock_value, K=strike, T=time_to_expiry, r=interest_rate, sigma=volatility)
-    elif option_kind == OptionKind.PUT:
-        option_value = put_value(S=stock_value, K=strike, T=time_to_expiry, r=interest_rate, sigma=volatility)
-
-    return option_value
-
-
-def calculate_option_delta(expiry_date, strike, option_kind, stock_value, interest_rate, volatility):
-    """
-    This function calculates the current option delta based on Black & Scholes assumptions.
-
-    expiry_date: dt.date     -  Expiry date of the option
-    strike: float            -  Strike price of the option
-    option_kind: OptionKind  -  Type of the option
-    stock_value:             -  Assumed stock value when calculating the Black-Scholes value
-    interest_rate:           -  Assumed interest rate when calculating the Black-Scholes value
-    volatility:              -  Assumed volatility of when calculating the Black-Scholes value
-    """
-    time_to_expiry = calculate_current_time_to_date(expiry_date)
-
-    if option_kind == OptionKind.CALL:
-        option_delta = call_delta(S=stock_value, K=strike, T=time_to_expiry, r=interest_rate, sigma=volatility)
-    elif option_kind == OptionKind.PUT:
-        option_delta = put_delta(S=stock_value, K=strike, T=time_to_expiry, r=interest_rate, sigma=volatility)
-    else:
-        raise Exception(f"""Got unexpected value for option_kind argument, should be OptionKind.CALL or OptionKind.PUT but was {option_kind}.""")
-
-    return option_delta
-
-
-def update_quotes(option_id, theoretical_price, credit, volume, position_limit, tick_size):
+def update_quotes(option_id, theoretical_price, credit, volume, position_limit, tick_size, positions, force=False):
     """
     This function updates the quotes specified by <option_id>. We take the following actions in sequence:
-        - pull (remove) any current oustanding orders
         - add credit to theoretical price and round to nearest tick size to create a set of bid/ask quotes
         - calculate max volumes to insert as to not pass the position_limit
-        - reinsert limit orders on those levels
+        - skip the update if these quotes are the ones already resting and nothing traded since they were inserted
+        - otherwise pull (remove) any current oustanding orders and reinsert limit orders on those levels
 
     Arguments:
         option_id: str           -  Exchange Instrument ID of the option to trade
@@ -104,25 +99,27 @@ def update_quotes(option_id, theoretical_price, credit, volume, position_limit,
         volume:                  -  Volume (# lots) of the inserted orders (given they do not breach position limits)
         position_limit: int      -  Position limit (long/short) to avoid crossing
         tick_size: float         -  Tick size of the quoted instrument
+        positions: dict          -  Positions per instrument ID, fetched once per loop iteration by the caller
+        force: bool              -  Pull and reinsert the quotes even if they did not change
+
+    Returns True if the quotes were pulled and reinserted, False if the resting quotes were left untouched.
+    Requotes are paced by quote_rate_limiter and exchange calls are serialized by exchange_lock, so this function can
+    be called from several threads at once.
     """
+    log.debug('\nUpdating instrument %s', option_id)
 
-    # Print any new trades
-    trades = exchange.poll_new_trades(instrument_id=option_id)
+    # Log any new trades
+    with exchange_lock:
+        trades = exchange.poll_new_trades(instrument_id=option_id)
     for trade in trades:
-        print(f'- Last period, traded {trade.volume} lots in {option_id} at price {trade.price:.2f}, side {trade.side}.')
-
-    # Pull (remove) all existing outstanding orders
-    orders = exchange.get_outstanding_orders(instrument_id=option_id)
-    for order_id, order in orders.items():
-        print(f'- Deleting old {order.side} order in {option_id} for {order.volume} @ {order.price:8.2f}.')
-        exchange.delete_order(instrument_id=option_id, order_id=order_id)
+        log.info('- Last period, traded %s lots in %s at price %.2f, side %s.', trade.volume, option_id, trade.price, trade.side)
 
     # Calculate bid and ask price
     bid_price = round_down_to_tick(theoretical_price - credit, tick_size)
     ask_price = round_up_to_tick(theoretical_price + credit, tick_size)
 
     # Calculate bid and ask volumes, taking into account the provided position_limit
-    position = exchange.get_positions()[option_id]
+    position = positions[option_id]
 
     max_volume_to_buy = position_limit - position
     max_volume_to_sell = position_limit + position
@@ -130,161 +127,238 @@ def update_quotes(option_id, theoretical_price, credit, volume, position_limit,
     bid_volume = min(volume, max_volume_to_buy)
     ask_volume = min(volume, max_volume_to_sell)
 
-    # Insert new limit orders
-    if bid_volume > 0:
-        print(f'- Inserting bid limit order in {option_id} for {bid_volume} @ {bid_price:8.2f}.')
+    # Leave the resting orders alone if requoting would reinsert the exact same orders
+    quotes = (bid_price, ask_price, bid_volume, ask_volume, position)
+    if not force and not trades and last_quotes.get(option_id) == quotes:
+        log.debug('- Quotes in %s unchanged, keeping outstanding orders.', option_id)
+        return False
+
+    quote_rate_limiter.acquire()
+    with exchange_lock:
+        # Pull (remove) all existing outstanding orders
+        orders = exchange.get_outstanding_orders(instrument_id=option_id)
+        for order_id, order in orders.items():
+            log.debug('- Deleting old %s order in %s for %s @ %8.2f.', order.side, option_id, order.volume, order.price)
+            exchange.delete_order(instrument_id=option_id, order_id=order_id)
+
+        # Insert new limit orders
+        if bid_volume > 0:
+            log.debug('- Inserting bid limit order in %s for %s @ %8.2f.', option_id, bid_volume, bid_price)
+            exchange.insert_order(
+                instrument_id=option_id,
+                price=bid_price,
+                volume=bid_volume,
+                side='bid',
+                order_type='limit',
+            )
+        if ask_volume > 0:
+            log.debug('- Inserting ask limit order in %s for %s @ %8.2f.', option_id, ask_volume, ask_price)
+            exchange.insert_order(
+                instrument_id=option_id,
+                price=ask_price,
+                volume=ask_volume,
+                side='ask',
+                order_type='limit',
+            )
+
+    last_quotes[option_id] = quotes
+    return True
+
+
+def compute_portfolio_greeks(positions, stock_id, option_ids, deltas, gammas, vegas):
+    """
+    This function aggregates the delta, gamma and vega position of the portfolio, as one dot product per greek
+    between the option greeks and the option positions. Each stock unit has a delta of 1 by definition and no gamma
+    or vega.
+
+    Arguments:
+        positions: dict         -  Current position per instrument ID, as returned by the exchange
+        stock_id: str           -  Exchange Instrument ID of the underlying stock
+        option_ids: List[str]   -  Exchange Instrument IDs of the options, in the order of the greek arrays
+        deltas: np.ndarray      -  Black-Scholes delta of each option
+        gammas: np.ndarray      -  Black-Scholes gamma of each option
+        vegas: np.ndarray       -  Black-Scholes vega of each option
+
+    Returns the total delta, gamma and vega position as a tuple.
+    """
+    option_positions = np.array([positions[option_id] for option_id in option_ids], dtype=float)
+
+    total_delta = positions[stock_id] + deltas @ option_positions
+    total_gamma = gammas @ option_positions
+    total_vega = vegas @ option_positions
+
+    if log.isEnabledFor(logging.DEBUG):
+        for option_id, position, option_delta, option_gamma, option_vega in zip(
+                option_ids, option_positions, deltas, gammas, vegas):
+            log.debug('- The current position in option %s is %s, delta %.4f, gamma %.6f, vega %.4f.',
+                      option_id, position, option_delta, option_gamma, option_vega)
+
+    log.info('- The current total aggregate delta position is %s.', total_delta)
+    log.info('- The current total aggregate gamma position is %s.', total_gamma)
+    log.info('- The current total aggregate vega position is %s.', total_vega)
+    return total_delta, total_gamma, total_vega
+
+
+def limit_hedge_volume(volume, position, position_limit):
+    """
+    This function clips the signed hedge <volume> (positive to buy, negative to sell) so that trading it from
+    <position> does not cross the long or short <position_limit>.
+    """
+    return max(-position_limit - position, min(position_limit - position, volume))
+
+
+def trade_at_best_price(instrument_id, order_book, volume):
+    """
+    This function trades the signed <volume> (positive to buy, negative to sell) in <instrument_id> with an IOC order
+    at the best opposite price of <order_book>, returning the volume sent or 0 if that side of the book is empty.
+
+    The volume is capped at what the best level offers, excluding our own quote resting at that price (see
+    last_quotes), so that the returned volume is what the IOC can fill against other traders. Orders are paced by
+    quote_rate_limiter, like the requotes.
+    """
+    own_quotes = last_quotes.get(instrument_id)
+    if volume > 0 and order_book and order_book.asks:
+        best_ask = order_book.asks[0]
+        available_volume = best_ask.volume
+        if own_quotes is not None and own_quotes[1] == best_ask.price:
+            available_volume -= own_quotes[3]
+        volume = min(volume, available_volume)
+        if volume <= 0:
+            return 0
+        quote_rate_limiter.acquire()
         exchange.insert_order(
-            instrument_id=option_id,
-            price=bid_price,
-            volume=bid_volume,
+            instrument_id=instrument_id,
+            price=best_ask.price,
+            volume=volume,
             side='bid',
-            order_type='limit',
-        )
-    if ask_volume > 0:
-        print(f'- Inserting ask limit order in {option_id} for {ask_volume} @ {ask_price:8.2f}.')
+            order_type='ioc')
+        return volume
+    if volume < 0 and order_book and order_book.bids:
+        best_bid = order_book.bids[0]
+        available_volume = best_bid.volume
+        if own_quotes is not None and own_quotes[0] == best_bid.price:
+            available_volume -= own_quotes[2]
+        volume = -min(-volume, available_volume)
+        if volume >= 0:
+            return 0
+        quote_rate_limiter.acquire()
         exchange.insert_order(
-            instrument_id=option_id,
-            price=ask_price,
-            volume=ask_volume,
+            instrument_id=instrument_id,
+            price=best_bid.price,
+            volume=-volume,
             side='ask',
-            order_type='limit',
-        )
+            order_type='ioc')
+        return volume
+    return 0
 
 
-def hedge_delta_position(stock_id, options, stock_value):
+def hedge_delta_position(stock_id, total_delta, stock_position, position_limit=100, stock_book=None):
     """
-    This function (once finished) hedges the outstanding delta position by trading in the stock.
+    This function hedges the outstanding delta position by trading in the stock.
 
     That is:
-        - It calculates how sensitive the total position value is to changes in the underlying by summing up all
-          individual delta component.
+        - It takes the total delta position of the portfolio, as aggregated by compute_portfolio_greeks.
         - And then trades stocks which have the opposite exposure, to remain, roughly, flat delta exposure
 
     Arguments:
         stock_id: str         -  Exchange Instrument ID of the stock to hedge with
-        options: List[dict]   -  List of options with details to calculate and sum up delta positions for
-        stock_value: float    -  The stock value to assume when making delta calculations using Black-Scholes
+        total_delta: float    -  Total delta position of the portfolio, stock included
+        stock_position: int   -  Current position in the stock
+        position_limit: int   -  Position limit (long/short) to avoid crossing, also for the stock
+        stock_book:           -  Stock order book fetched this loop iteration, requested if not given
+
+    Returns the signed number of stocks traded (positive when bought), so the caller can update its delta.
     """
+    log.info('- The current position in the stock %s is %s.', stock_id, stock_position)
 
-    # A2: Calculate the delta position here
-    positions = exchange.get_positions()  #Each stock unit has a delta of 1 by definition, so the stock delta position is simply equivalent to the stock position
-    Total_aggregate_delta_position = positions[stock_id] 
-
-    for option_id, option in options.items():
-        position = positions[option_id]
-        print(f"- The current position in option {option_id} is {position}.")
-        BS_delta = calculate_option_delta(expiry_date=option.expiry,  strike=option.strike, option_kind=option.option_kind, stock_value=stock_value, interest_rate=0.03, volatility=3.0)  #A2 1
-        print(f"- The current delta in option {option_id} is {BS_delta}.")
-        Delta_position = BS_delta * position            # A2 2
-        print(f"- The current delta position in option {option_id} is {Delta_position}.")
-        Total_aggregate_delta_position = Total_aggregate_delta_position + Delta_position        #A2 3
-        print(f"- The current total aggregate delta position is {Total_aggregate_delta_position}.") #A2 4
-
-    stock_position = positions[stock_id]
-    print(f'- The current position in the stock {stock_id} is {stock_position}.')
-
-    # A3: Implement the delta hedge here, staying mindful of the overall position-limit of 100, also for the stocks. 
-    #Number of stocks is minus option delta times the stock position
-    #stock_position = -1*positions[stock_id]*calculate_option_delta(expiry_date=option.expiry, strike=option.strike, 
-    #option_kind=option.option_kind, stock_value=stock_value, interest_rate=0.03, volatility=3.0)
-        #mv_buy = 100 - positions[stock_id]
-    #mv_sell = positions[stock_id]
-
-    #bid_v = min(number_of_stocks, mv_buy)
-    #ask_v = min(number_of_stocks, mv_sell)
-    
-    number_of_stocks = -1*positions[stock_id]*calculate_option_delta(expiry_date=option.expiry, strike=option.strike, 
-    option_kind=option.option_kind, stock_value=stock_value, interest_rate=0.03, volatility=3.0)
-    
-    stock_order_book = exchange.get_last_price_book(stock_id)    
-    best_bid_price = stock_order_book.bids[0].price
-    best_ask_price = stock_order_book.asks[0].price
-
-    if Total_aggregate_delta_position < 0:
-        if 1 <= abs(positions[stock_id]) - number_of_stocks <= 100:  
-            n_o_s = number_of_stocks
-        else: 
-            n_o_s = 0 #changed
-        exchange.insert_order(
-                    instrument_id=stock_id,
-                    price=best_ask_price,
-                    volume= (-1) * int(n_o_s), #added (-1) otherwise it fails because negative
-                    side='bid',
-                    order_type='ioc')
-        print(f'- Delta hedge implemented.')
-    elif Total_aggregate_delta_position > 0: 
-        if 1 <= positions[stock_id] + number_of_stocks <= 100:  
-            n_o_s = number_of_stocks
-        else: 
-            n_o_s = 0 #changed
-        exchange.insert_order(
-                    instrument_id=stock_id,
-                    price=best_bid_price,
-                    volume= (-1) * int(n_o_s), #added (-1) otherwise it fails because negative
-                    side='ask',
-                    order_type='ioc')
-        print(f'- Delta hedge implemented.')
+    # Each stock unit has a delta of 1, so minus the total delta in stocks flattens the portfolio
+    number_of_stocks = limit_hedge_volume(-int(round(total_delta)), stock_position, position_limit)
+
+    if number_of_stocks == 0:
+        log.info('- Delta is zero.')
+        return 0
+
+    stock_order_book = stock_book if stock_book is not None else exchange.get_last_price_book(stock_id)
+    number_of_stocks = trade_at_best_price(stock_id, stock_order_book, number_of_stocks)
+    log.info('- Delta hedge implemented.')
+    return number_of_stocks
+
+
+def hedge_greek_with_option(stock_id, option_ids, deltas, option_greeks, total_greek, total_delta, positions,
+                            stock_book, position_limit, greek_name):
+    """
+    This function flattens a greek the stock has no exposure to (gamma or vega) by trading a single option, and then
+    flattens the delta left after that option trade by trading stocks.
+
+    That is:
+        - It picks the option with the highest positive greek, which flattens the position with the fewest lots.
+          Options without any of the greek left, e.g. past expiry, are never picked.
+        - It solves option_trade * option_greek = -total_greek, then stock_trade = -(total_delta + option_trade *
+          option_delta), and sends both trades once.
+
+    Arguments:
+        stock_id: str              -  Exchange Instrument ID of the stock to hedge with
+        option_ids: List[str]      -  Exchange Instrument IDs of the options, in the order of the greek arrays
+        deltas: np.ndarray         -  Black-Scholes delta of each option
+        option_greeks: np.ndarray  -  Black-Scholes greek to flatten, of each option
+        total_greek: float         -  Total position in the greek to flatten
+        total_delta: float         -  Total delta position of the portfolio, stock included
+        positions: dict            -  Positions per instrument ID fetched this loop iteration
+        stock_book:                -  Stock order book fetched this loop iteration
+        position_limit: int        -  Position limit (long/short) to avoid crossing, for the option and the stock
+        greek_name: str            -  Name of the greek, for logging
+    """
+    candidates = np.flatnonzero(option_greeks > 0)
+    option_trade = 0
+    option_delta = 0.0
+    if len(candidates) > 0:
+        hedge_index = candidates[np.argmax(option_greeks[candidates])]
+        hedge_option_id = option_ids[hedge_index]
+        option_delta = deltas[hedge_index]
+        option_trade = limit_hedge_volume(-int(round(total_greek / option_greeks[hedge_index])),
+                                          positions[hedge_option_id], position_limit)
+
+    if option_trade != 0:
+        option_book = exchange.get_last_price_book(hedge_option_id)
+        option_trade = trade_at_best_price(hedge_option_id, option_book, option_trade)
+        log.info('- %s hedge implemented, traded %s lots in %s.', greek_name, option_trade, hedge_option_id)
     else:
-        print(f'- Delta is zero.')
-
-#  exchange.insert_order(
-#             instrument_id=option_id,
-#             price=bid_price,
-#             volume=bid_volume,
-#             side='bid',
-#             order_type='limit',
-    
-def hedge_gamma_position(stock_id, options, stock_value):
+        log.info('- %s is zero.', greek_name)
+
+    hedge_delta_position(stock_id, total_delta + option_trade * option_delta, positions[stock_id],
+                         position_limit=position_limit, stock_book=stock_book)
+
+
+def hedge_gamma_position(stock_id, option_ids, deltas, gammas, vegas, positions=None, stock_book=None,
+                         position_limit=100):
     """
-#     This function (once finished) hedges the outstanding gamma position by trading options.
-
-#     That is:
-#         - It calculates how sensitive the total position value is to changes in the delta by summing up all
-#           individual gamma components.
-#         - And then trades stocks which have the opposite exposure, to remain, roughly, flat gamma exposure
-
-#     Arguments:
-#         stock_id: str         -  Exchange Instrument ID of the stock to hedge with
-#         options: List[dict]   -  List of options with details to calculate and sum up gamma positions for
-#         stock_value: float    -  The stock value to assume when making delta calculations using Black-Scholes
-#     """
-
-    #Make portfolio delta neutral
-    hedge_delta_position(stock_id, options, stock_value)
-   
-    #calculates gamma position
-    positions = exchange.get_positions()  
-    Total_aggregate_gamma_position = positions[stock_id] 
-
-    for option_id, option in options.items():
-        position = positions[option_id]
-        print(f"- The current position in option {option_id} is {position}.")
-        BS_gamma = gamma(theoretical_value, option.strike, calculate_current_time_to_date(option.expiry), 0.03, 3.0)
-        Gamma_position = BS_gamma * position            
-        print(f"- The current gamma position in option {option_id} is {Gamma_position}.")
-        Total_aggregate_gamma_position = Total_aggregate_gamma_position + Gamma_position       
-        print(f"- The current total aggregate gamma position is {Total_aggregate_gamma_position}.") 
-
-    stock_position = positions[stock_id]
-    print(f'- The current position in the stock {stock_id} is {stock_position}.')
-
-    #Implementing gamma hedge with options
-    for option_id, option in options.items():
-        num_additional_options = Total_aggregate_gamma_position/gamma(theoretical_value, option.strike,
-        calculate_current_time_to_date(option.expiry), 0.03, 3.0)
-        stock_order_book = exchange.get_last_price_book(stock_id)    
-        best_bid_price = stock_order_book.bids[0].price
-        best_ask_price = stock_order_book.asks[0].price
-        exchange.insert_order(
-            instrument_id=option_id,
-            price=best_ask_price,
-            volume=num_additional_options,
-            side='ask',
-            order_type='limit')
-    
-    #Making gamma neutral portfolio delta neutral
-    hedge_delta_position(stock_id, options, stock_value)
-    
+    This function hedges the outstanding gamma position by trading an option, and the delta by trading stocks.
+
+    That is:
+        - It calculates the delta, gamma and vega position of the portfolio with compute_portfolio_greeks.
+        - As the stock has no gamma, the option trade alone flattens the gamma position, and the stock trade then
+          flattens the delta position left after the option trade, see hedge_greek_with_option.
+
+    Arguments:
+        stock_id: str           -  Exchange Instrument ID of the stock to hedge with
+        option_ids: List[str]   -  Exchange Instrument IDs of the options, in the order of the greek arrays
+        deltas: np.ndarray      -  Black-Scholes delta of each option
+        gammas: np.ndarray      -  Black-Scholes gamma of each option
+        vegas: np.ndarray       -  Black-Scholes vega of each option
+        positions: dict         -  Positions per instrument ID fetched this loop iteration, requested if not given
+        stock_book:             -  Stock order book fetched this loop iteration, requested if not given
+        position_limit: int     -  Position limit (long/short) to avoid crossing, for the option and the stock
+    """
+    if positions is None:
+        positions = exchange.get_positions()
+    if stock_book is None:
+        stock_book = exchange.get_last_price_book(stock_id)
+    total_delta, total_gamma, _ = compute_portfolio_greeks(positions, stock_id, option_ids, deltas, gammas, vegas)
+
+    hedge_greek_with_option(stock_id, option_ids, deltas, gammas, total_gamma, total_delta, positions, stock_book,
+                            position_limit, 'Gamma')
+
+
 def load_instruments_for_underlying(underlying_stock_id):
     all_instruments = exchange.get_instruments()
     stock = all_instruments[underlying_stock_id]
@@ -292,90 +366,107 @@ def load_instruments_for_underlying(underlying_stock_id):
               for instrument_id, instrument in all_instruments.items()
               if instrument.instrument_type == InstrumentType.STOCK_OPTION
               and instrument.base_instrument_id == underlying_stock_id}
-    return stock, options
 
-def hedge_vega_position(stock_id, options, stock_value):
+    # Structure-of-arrays view of the option chain, so that all options can be priced in one vectorized pass
+    option_ids = list(options)
+    strikes = np.array([option.strike for option in options.values()], dtype=float)
+    # Expiries are kept as seconds since the epoch, so the time to expiry is a subtraction against time.time()
+    expiries = np.array([option.expiry.timestamp() for option in options.values()], dtype=float)
+    is_call = np.array([option.option_kind == OptionKind.CALL for option in options.values()], dtype=bool)
+    return stock, options, option_ids, strikes, expiries, is_call
+
+
+def hedge_vega_position(stock_id, option_ids, deltas, gammas, vegas, positions=None, stock_book=None,
+                        position_limit=100):
     """
-#     This function hedges the outstanding vega position by trading options.
-
-#     That is:
-#         - It calculates how sensitive the total position value is to changes in the underlying asset's volatility by summing up all
-#           individual vega components.
-#         - And then trades stocks which have the opposite exposure, to remain, roughly, flat vega exposure
-
-#     Arguments:
-#         stock_id: str         -  Exchange Instrument ID of the stock to hedge with
-#         options: List[dict]   -  List of options with details to calculate and sum up delta positions for
-#         stock_value: float    -  The stock value to assume when making delta calculations using Black-Scholes
-#     """
-
-    #calculates vega position
-    positions = exchange.get_positions()  
-    Total_aggregate_vega_position = positions[stock_id] 
-
-    for option_id, option in options.items():
-        position = positions[option_id]
-        print(f"- The current position in option {option_id} is {position}.")
-        BS_vega = call_vega(theoretical_value, option.strike, calculate_current_time_to_date(option.expiry), 0.03, 3.0)
-        print(f"- The current vega in option {option_id} is {BS_vega}.")
-        Vega_position = BS_vega * position            
-        print(f"- The current vega position in option {option_id} is {Vega_position}.")
-        Total_aggregate_vega_position = Total_aggregate_vega_position + Vega_position       
-        print(f"- The current total aggregate vega position is {Total_aggregate_vega_position}.") 
-
-    stock_position = positions[stock_id]
-    print(f'- The current position in the stock {stock_id} is {stock_position}.')
-
-    #Implementing vega hedge with options
-    #stock_position = -1*positions[stock_id]*calculate_option_delta(expiry_date=option.expiry, strike=option.strike, 
-    #option_kind=option.option_kind, stock_value=stock_value, interest_rate=0.03, volatility=3.0)
-    positions = -1*positions[stock_id]*calculate_option_delta(expiry_date=option.expiry, strike=option.strike, 
-    option_kind=option.option_kind, stock_value=stock_value, interest_rate=0.03, volatility=3.0)
-    
+    This function hedges the outstanding vega position by trading an option, and the delta by trading stocks.
+
+    That is:
+        - It calculates the delta, gamma and vega position of the portfolio with compute_portfolio_greeks.
+        - As the stock has no vega, the option trade alone flattens the vega position, and the stock trade then
+          flattens the delta position left after the option trade, see hedge_greek_with_option.
+
+    Arguments:
+        stock_id: str           -  Exchange Instrument ID of the stock to hedge with
+        option_ids: List[str]   -  Exchange Instrument IDs of the options, in the order of the greek arrays
+        deltas: np.ndarray      -  Black-Scholes delta of each option
+        gammas: np.ndarray      -  Black-Scholes gamma of each option
+        vegas: np.ndarray       -  Black-Scholes vega of each option
+        positions: dict         -  Positions per instrument ID fetched this loop iteration, requested if not given
+        stock_book:             -  Stock order book fetched this loop iteration, requested if not given
+        position_limit: int     -  Position limit (long/short) to avoid crossing, for the option and the stock
+    """
+    if positions is None:
+        positions = exchange.get_positions()
+    if stock_book is None:
+        stock_book = exchange.get_last_price_book(stock_id)
+    total_delta, _, total_vega = compute_portfolio_greeks(positions, stock_id, option_ids, deltas, gammas, vegas)
+
+    hedge_greek_with_option(stock_id, option_ids, deltas, vegas, total_vega, total_delta, positions, stock_book,
+                            position_limit, 'Vega')
+
+
 # Load all instruments for use in the algorithm
 STOCK_ID = 'NVDA'
-print(f'STOCK_ID = {STOCK_ID}')
-stock, options = load_instruments_for_underlying(STOCK_ID)
+log.info('STOCK_ID = %s', STOCK_ID)
+stock, options, option_ids, strikes, expiries, is_call = load_instruments_for_underlying(STOCK_ID)
+iteration = 0
+last_stock_value = None
+last_update_time = 0.0
 
 while True:
-    print(f'')
-    print(f'-----------------------------------------------------------------')
-    print(f'TRADE LOOP ITERATION ENTERED AT {str(dt.datetime.now()):18s} UTC.')
-    print(f'-----------------------------------------------------------------')
-
-    stock_value = get_midpoint_value(STOCK_ID)
+    # The stock book is fetched once and shared by the quoting and hedging below
+    stock_book = exchange.get_last_price_book(STOCK_ID)
+    stock_value = get_midpoint_value(STOCK_ID, stock_book)
     if stock_value is None:
-        print('Empty stock order book on bid or ask-side, or both, unable to update option prices.')
+        log.info('Empty stock order book on bid or ask-side, or both, unable to update option prices.')
         time.sleep(4)
         continue
 
-    for option_id, option in options.items():
-        print(f"\nUpdating instrument {option_id}")
-
-        theoretical_value = calculate_theoretical_option_value(expiry=option.expiry,
-                                                               strike=option.strike,
-                                                               option_kind=option.option_kind,
-                                                               stock_value=stock_value,
-                                                               interest_rate=0.03,
-                                                               volatility=3.0)
-
-                
-           
-        print(f"option.expiry = {option.expiry}")
-        update_quotes(option_id=option_id,
-                      theoretical_price=theoretical_value,
-                      credit=call_vega(theoretical_value, option.strike, calculate_current_time_to_date(option.expiry), 0.03, 3.0),
-                      volume=5,  # used to be 3
-                      position_limit=100,
-                      tick_size=0.10)
-#credit = theoretical_value + call_vega(theoretical_value, option.strike, option.expiry, 0.03, 3.0)
-#time_to_expiry = calculate_current_time_to_date(expiry_date)
-        # Wait 1/5th of a second to avoid breaching the exchange frequency limit
-        time.sleep(0.20)
-
-    print(f'\nHedging delta position')
-    #hedge_delta_position(STOCK_ID, options, stock_value)
-
-    hedge_gamma_position(STOCK_ID, options, stock_value)
-    print(f'\nSleeping for 4 seconds.')
-    time.sleep(4)
+    now_epoch = time.time()
+    if (last_stock_value is not None
+            and abs(stock_value - last_stock_value) < 0.5 * stock.tick_size
+            and now_epoch - last_update_time < MAX_SECONDS_BETWEEN_UPDATES):
+        time.sleep(POLL_INTERVAL_SECONDS)
+        continue
+    last_stock_value = stock_value
+    last_update_time = now_epoch
+
+    iteration += 1
+    log.info('')
+    log.info('-----------------------------------------------------------------')
+    log.info('TRADE LOOP ITERATION ENTERED AT %-18s UTC.', dt.datetime.fromtimestamp(now_epoch))
+    log.info('-----------------------------------------------------------------')
+
+    # Positions are fetched once and shared by the quoting and hedging below
+    positions = exchange.get_positions()
+
+    times_to_expiry = calculate_tte_epoch(expiries, now_epoch)
+    # Terms of d1/d2 that only depend on the time to expiry, so the kernel reduces d1 to a log, an add and a divide
+    sqrt_times_to_expiry, sigma_sqrt_times_to_expiry, drifts, discount_factors = bs_expiry_terms(
+        times_to_expiry, 0.03, 3.0)
+
+    # Price the whole chain at once, the credit is the vega evaluated at the theoretical value
+    theoretical_values, deltas, vegas = bs_chain_price_delta_vega(
+        stock_value, strikes, sqrt_times_to_expiry, sigma_sqrt_times_to_expiry, drifts, discount_factors, is_call)
+    # Gamma follows from vega without another pass over the chain, as vega = S^2 * sigma * T * gamma
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gammas = np.where(times_to_expiry > MIN_TIME_TO_EXPIRY, vegas / (stock_value ** 2 * 3.0 * times_to_expiry), 0.0)
+    credits = call_vega(theoretical_values, strikes, times_to_expiry, 0.03, 3.0)
+
+    force_requote = iteration % REQUOTE_EVERY_N_ITERATIONS == 0
+    # Consuming the results waits for all options to be requoted, and raises any exception from the worker threads
+    list(quote_executor.map(
+        lambda option_id, theoretical_value, credit: update_quotes(option_id=option_id,
+                                                                   theoretical_price=theoretical_value,
+                                                                   credit=credit,
+                                                                   volume=5,  # used to be 3
+                                                                   position_limit=100,
+                                                                   tick_size=0.10,
+                                                                   positions=positions,
+                                                                   force=force_requote),
+        option_ids, theoretical_values, credits))
+
+    log.info('\nHedging gamma and delta position')
+    hedge_gamma_position(STOCK_ID, option_ids, deltas, gammas, vegas, positions=positions, stock_book=stock_book)
+    log.info('\nWaiting for the stock to move.')